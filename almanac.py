@@ -0,0 +1,164 @@
+# A precomputed almanac of Easter and Passover dates, in a compact binary
+# file that any number of processes can memory-map and share, rather than
+# each of them running the computus for itself.
+#
+# The file is a 32-byte header followed by one fixed-width record per year,
+# in order, each holding the JDs below as little-endian 32-bit integers.
+# Everything else that gregorian_easter and julian_easter return can be
+# worked out from those.
+#
+# Usage: python almanac.py FIRST LAST FILE
+
+import computus
+
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import numpy
+
+magic = 'ALMANAC\0'
+version = 1
+header_format = '<8sIiiI8x'
+header_size = struct.calcsize(header_format)
+
+record_dtype = numpy.dtype([
+        ('gregorian_easter', '<i4'),
+        ('gregorian_equinox', '<i4'),
+        ('gregorian_new_moon', '<i4'),
+        ('julian_easter', '<i4'),
+        ('julian_uncorrected_easter', '<i4'),
+        ('julian_equinox', '<i4'),
+        ('julian_new_moon', '<i4'),
+        ('passover', '<i4') ])
+
+# Every JD we store falls within its own year, by either calendar, and has to
+# fit in 32 bits; NumPy would wrap one that doesn't without a word.  That
+# rules out years more than about 5.8 million from the present.
+
+jd_limits = (-2 ** 31, 2 ** 31 - 1)
+
+def check_range(first_year, last_year):
+    lowest = min(computus.gregorian_to_jd((first_year, 1, 1)),
+            computus.julian_to_jd((first_year, 1, 1)))
+    highest = max(computus.gregorian_to_jd((last_year, 12, 31)),
+            computus.julian_to_jd((last_year, 12, 31)))
+    if lowest < jd_limits[0] or highest > jd_limits[1]:
+        raise ValueError('%d-%d is too far out for an almanac' %
+                (first_year, last_year))
+
+# Build the almanac a chunk of years at a time, so that memory use doesn't
+# grow with the range.  We write it to a temporary file alongside and rename
+# that into place when it's done: anyone who has the old almanac mapped keeps
+# the old file, rather than having it truncated out from under them.
+
+def build(path, first_year, last_year, chunk_years=10000):
+    check_range(first_year, last_year)
+    (fd, temp_path) = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(struct.pack(header_format, magic, version, first_year,
+                    last_year - first_year + 1, record_dtype.itemsize))
+            for start in xrange(first_year, last_year + 1, chunk_years):
+                years = numpy.arange(start,
+                        min(start + chunk_years, last_year + 1))
+                f.write(records(years).tostring())
+
+        # mkstemp makes the file readable by us alone; give it the
+        # permissions a plain open would have.
+
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp_path, 0666 & ~umask)
+        os.rename(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+def records(years):
+    check_range(int(numpy.min(years)), int(numpy.max(years)))
+    gregorian_data = computus.gregorian_easter_many(years)
+    julian_data = computus.julian_easter_many(years)
+    chunk = numpy.empty(len(years), dtype=record_dtype)
+    for key in record_dtype.names:
+        if key in gregorian_data: chunk[key] = gregorian_data[key]
+        else: chunk[key] = julian_data[key]
+    return chunk
+
+class Almanac(object):
+
+    def __init__(self, path):
+        unreadable = ValueError('%s is not an almanac we can read' % path)
+        with open(path, 'rb') as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, mmap.error):
+                raise unreadable
+        if len(self.map) < header_size: raise unreadable
+        (file_magic, file_version, self.first_year, count, record_size) = \
+                struct.unpack_from(header_format, self.map)
+        if (file_magic != magic or file_version != version or
+                record_size != record_dtype.itemsize or
+                len(self.map) != header_size + count * record_size):
+            raise unreadable
+        self.last_year = self.first_year + count - 1
+
+        # This is a view straight onto the mapped file; nothing is copied.
+
+        self.records = numpy.frombuffer(self.map, dtype=record_dtype,
+                count=count, offset=header_size)
+
+    def record(self, year):
+        if not self.first_year <= year <= self.last_year:
+            raise ValueError('%d is outside %d-%d' %
+                    (year, self.first_year, self.last_year))
+        return self.records[year - self.first_year]
+
+    # The records for a range of years, as a view onto the file.
+
+    def span(self, first_year, last_year):
+        self.record(first_year)
+        self.record(last_year)
+        return self.records[first_year - self.first_year:
+                last_year - self.first_year + 1]
+
+    def gregorian_easter(self, year):
+        record = self.record(year)
+        new_moon = int(record['gregorian_new_moon'])
+        return {
+                'gregorian_easter' : int(record['gregorian_easter']),
+                'gregorian_equinox' : int(record['gregorian_equinox']),
+                'gregorian_new_moon' : new_moon,
+                'gregorian_full_moon' : new_moon + 13
+                }
+
+    def julian_easter(self, year):
+        record = self.record(year)
+        easter_day = int(record['julian_easter'])
+        presumptive_easter = int(record['julian_uncorrected_easter'])
+        new_moon = int(record['julian_new_moon'])
+        passover_begins = int(record['passover'])
+        return {
+                'julian_easter' : easter_day,
+                'julian_uncorrected_easter' : presumptive_easter,
+                'julian_equinox' : int(record['julian_equinox']),
+                'julian_new_moon' : new_moon,
+                'julian_full_moon' : new_moon + 13,
+                'julian_passover_correction' : easter_day != presumptive_easter,
+                'passover' : passover_begins,
+                'passover_prep' : passover_begins - 1,
+                'nissan' : passover_begins - 14
+                }
+
+    # Let go of the file.  Any views that span or record handed out still
+    # hold on to the mapping, which only goes away once they do too.
+
+    def close(self):
+        self.records = None
+        self.map = None
+
+if __name__ == '__main__':
+    build(sys.argv[3], int(sys.argv[1]), int(sys.argv[2]))
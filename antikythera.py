@@ -1,54 +1,240 @@
 # THE ANTIKYTHERA MECHANISM
 # computes anything and everything you might care to know about calendars
 
+import cache
 import computus
+import export
 import hebrew
+import timing
 
 import cgi
 import cgitb
+import cStringIO
+import hashlib
+import json
 import os
+import re
+import sys
 
 phase_names = [ 'New', 'Waxing Crescent', 'First Quarter', 'Waxing Gibbous',
         'Full', 'Waning Gibbous', 'Last Quarter', 'Waning Crescent' ]
 
+# The old-fashioned way: run as a CGI script, once per request.
+
 def get():
     cgitb.enable()
     form = cgi.FieldStorage()
 
-    print 'Content-type: text/html'
-    print
-    interleave(int(os.environ["PATH_INFO"][1:]))
+    page = cached_page(int(os.environ["PATH_INFO"][1:]))
+    sys.stdout.write('Content-type: text/html\n\n' + page)
+
+# The new-fashioned way: a WSGI application, which stays resident between
+# requests, so everything computus and hebrew have cached stays warm.  Run
+# this file to serve it locally, or point any WSGI server at
+# antikythera:application.
+
+def application(environ, start_response):
+    path = environ.get('PATH_INFO', '/')
+    dump = re.match(r'^/export/(\d+)-(\d+)\.(\w+)$', path)
+    if (dump and int(dump.group(1)) <= int(dump.group(2)) and
+            dump.group(3) in export.formats):
+        (first_year, last_year, format) = dump.groups()
+        start_response('200 OK',
+                [ ('Content-Type', export.formats[format][1]) ])
+        return export.lines(int(first_year), int(last_year), format)
+    span = re.match(r'^/(\d+)-(\d+)$', path)
+    if span and int(span.group(1)) <= int(span.group(2)):
+        (first_year, last_year) = (int(span.group(1)), int(span.group(2)))
+
+        # Once the stream has started, it's too late to tell the client
+        # anything went wrong, so make sure first that every year will draw.
+
+        for year in xrange(first_year, last_year + 1):
+            if not renderable(year):
+                return respond(start_response, '404 Not Found', 'text/plain',
+                        'No calendar for %d.\n' % year)
+        start_response('200 OK', [ ('Content-Type', 'text/html') ])
+        return render_range(first_year, last_year)
+    if path == '/metrics':
+        return respond(start_response, '200 OK', 'application/json',
+                json.dumps(metrics(), indent=2, sort_keys=True) + '\n')
+    try:
+        year = int(path[1:])
+    except ValueError:
+        return respond(start_response, '404 Not Found', 'text/plain',
+                'Not found.\n')
+    if not renderable(year):
+        return respond(start_response, '404 Not Found', 'text/plain',
+                'No calendar for %d.\n' % year)
+
+    # A page is entirely determined by its year and the code that drew it,
+    # so if the client already has this one, we needn't even render it.
+
+    etag = '"%s"' % page_key(year)
+    if etag_matches(environ.get('HTTP_IF_NONE_MATCH'), etag):
+        start_response('304 Not Modified', [ ('ETag', etag) ])
+        return []
+
+    # With timing switched on, tell the client how long each stage took.
+    # A page that came out of the cache has only the one stage.
+
+    timing.begin_request()
+    with timing.stage('page'):
+        page = cached_page(year)
+    headers = [ ('ETag', etag) ]
+    stages = timing.end_request()
+    if stages: headers += [ ('Server-Timing', timing.server_timing(stages)) ]
+    return respond(start_response, '200 OK', 'text/html', page, headers)
+
+def respond(start_response, status, content_type, body, headers=()):
+    start_response(status, [
+            ('Content-Type', content_type),
+            ('Content-Length', str(len(body)))
+            ] + list(headers))
+    return [ body ]
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None: return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'): tag = tag[2:]
+        if tag == etag or tag == '*': return True
+    return False
+
+def serve(port=8000):
+    import wsgiref.simple_server
+    server = wsgiref.simple_server.make_server('', port, application)
+    print 'Serving on port %d' % port
+    server.serve_forever()
+
+# What /metrics reports: the running totals and histograms for each timed
+# stage (empty unless timing is switched on), and how well each cache is
+# doing.
+
+def metrics():
+    caches = {
+            'year_table_cache' : computus.year_table_cache,
+            'gregorian_cycle_cache' : computus.gregorian_cycle_cache,
+            'hebrew_year_cache' : hebrew.hebrew_year_cache,
+            'page_cache' : page_cache
+            }
+    if page_store is not None: caches['page_store'] = page_store
+    cache_info = {}
+    for name in caches:
+        info = caches[name].info()
+        lookups = info['hits'] + info['misses']
+        info['hit_rate'] = float(info['hits']) / lookups if lookups else None
+        cache_info[name] = info
+    return {
+            'timing' : timing.enabled,
+            'stages' : timing.info(),
+            'caches' : cache_info
+            }
+
+# Rendered pages are kept in memory, and also on disk if
+# ANTIKYTHERA_PAGE_CACHE names a directory to keep them in.  Either way
+# they're keyed by a hash of the source code, so they go stale by themselves
+# whenever the code changes.
+
+def source_version():
+    digest = hashlib.sha1()
+    for module in [ cache, computus, hebrew, sys.modules[__name__] ]:
+        source = os.path.splitext(module.__file__)[0] + '.py'
+        with open(source, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+code_version = source_version()
+
+page_cache = cache.LRUCache(512)
+
+if os.environ.get('ANTIKYTHERA_PAGE_CACHE'):
+    page_store = cache.DiskCache(os.environ['ANTIKYTHERA_PAGE_CACHE'])
+else:
+    page_store = None
+
+def page_key(year):
+    return '%s-%d' % (code_version, year)
+
+def cached_page(year):
+    key = page_key(year)
+    page = page_cache.get(key)
+    if page is None and page_store is not None:
+        page = page_store.get(key)
+        if page is not None: page_cache.put(key, page)
+    if page is None:
+        page = render_year(year)
+        page_cache.put(key, page)
+        if page_store is not None: page_store.put(key, page)
+    return page
+
+# Render a page covering a whole range of years, one table per year.  This
+# is a generator, yielding one week's row at a time, so that the server can
+# send the page as it goes (with chunked encoding, given no Content-Length),
+# and nothing but the current year's calendars is ever held in memory.
+
+def render_range(first_year, last_year):
+    yield """
+<div align="center">
+<a href="%d-%d">&lt;&lt; prev</a>
+&nbsp;&nbsp;&nbsp;
+<a href="%d-%d">next &gt;&gt;</a>
+""" % (2 * first_year - last_year - 1, first_year - 1,
+            last_year + 1, 2 * last_year - first_year + 1)
+
+    for year in range(first_year, last_year + 1):
+        yield """
+<h2><a href="%d">%d</a></h2>
+<table border="1" cellspacing="0">
+<tr>
+<th width="100">Sunday</th>
+<th width="100">Monday</th>
+<th width="100">Tuesday</th>
+<th width="100">Wednesday</th>
+<th width="100">Thursday</th>
+<th width="100">Friday</th>
+<th width="100">Saturday</th>
+""" % (year, year)
+        for row in window_rows(
+                computus.gregorian_to_jd((year, 3, 1)),
+                computus.gregorian_to_jd((year, 5, 31)),
+                year_calendars(year), compendium_index([ year ])):
+            yield row
+        yield '''
+</tr>
+</table>
+'''
+
+    yield '''
+</div>
+'''
 
-def interleave(year):
+# Render the page for a year into a buffer, rather than printing it.
 
-    start_date = computus.gregorian_to_jd((year, 3, 1))
-    end_date = computus.gregorian_to_jd((year, 5, 31))
+def render_year(year):
+    out = cStringIO.StringIO()
+    interleave(year, out)
+    return out.getvalue()
 
-    print 'start ' + str(start_date) + '<br>'
-    print 'end ' + str(end_date) + '<br>'
+# Everything below prints to out, or to stdout if out is None.
 
-    julian = julian_calendar(year)
-    gregorian = gregorian_calendar(year)
-    hebrew_cal = hebrew_calendar(hebrew.ad_to_am_at_pesach(year))
-    compendium = easter_compendium(year)
+def interleave(year, out=None, index=None):
 
-    i_julian = 0
-    i_hebrew = 0
-    i = 0
+    start_date = computus.gregorian_to_jd((year, 3, 1))
+    end_date = computus.gregorian_to_jd((year, 5, 31))
 
-    while julian[i_julian][0] != start_date: i_julian += 1
-    while gregorian[i][0] != start_date: i += 1
-    while hebrew_cal[i_hebrew][0] != start_date: i_hebrew += 1
-    offset = i_julian - i
-    hebrew_offset = i_hebrew - i
+    print >>out, 'start ' + str(start_date) + '<br>'
+    print >>out, 'end ' + str(end_date) + '<br>'
 
-    # Find Sunday.
-    while gregorian[i][3] != 0: i += 1
+    calendars = year_calendars(year)
+    if index is None:
+        with timing.stage('easter_compendium'):
+            index = compendium_index([ year ])
 
     prev = str(year - 1)
     next = str(year + 1)
 
-    print """
+    print >>out, """
 <div align="center">
 <a href=\"""" + prev + """">&lt;&lt; prev</a>
 &nbsp;&nbsp;&nbsp;
@@ -63,58 +249,117 @@ def interleave(year):
 <th width="100">Friday</th>
 <th width="100">Saturday</th>
 """
-    done = False
-    while not done:
-        if gregorian[i][3] == 0:
-            print '</tr>'
-            print '<tr>'
-        print '<td height="100" valign="top">'
-        jd = gregorian[i][0]
-        print str(jd) + '<br>'
-        if jd == end_date:
-            done = True
-            print 'Done!<br>'
-        print 'G',
-        print_calendar_entry(gregorian[i])
-        print '<br>'
-        print 'J',
-        print_calendar_entry(julian[i + offset])
-        print '<br>'
-        print 'H',
-        print_hebrew_calendar_entry(
-                hebrew_cal[i + hebrew_offset], gregorian[i][3])
-        print '<br>'
-        annotations = consult_compendium(compendium, jd)
-        j_easter = False
-        j_pre_easter = False
-        for a in annotations:
-            if a == 'gregorian_equinox': print 'Equinox (W)'
-            elif a == 'gregorian_full_moon': print 'Full Moon (W)'
-            elif a == 'gregorian_easter': print 'Easter (W)'
-            elif a == 'julian_equinox': print 'Equinox (E)'
-            elif a == 'julian_full_moon': print 'Full Moon (E)'
-            elif a == 'julian_easter':
-                print 'Easter (E)'
-                j_easter = True
-            elif a == 'julian_uncorrected_easter': j_pre_easter = True
-            elif a == 'passover': print 'Passover'
-            elif a == 'passover_prep': print 'Full Moon (H)'
-            if j_pre_easter and not j_easter: print 'Not Easter (E)'
-        print '</td>'
-        i += 1
-
-    print '''
+    with timing.stage('render'):
+        render_window(start_date, end_date, calendars, index, out)
+
+    print >>out, '''
 </tr>
 </table>
 </div>
 '''
 
-def consult_compendium(compendium, jd):
-    annotations = []
-    for key in compendium:
-        if compendium[key] == jd:
-            annotations += [ key ]
-    return annotations
+# The days a year's page shows: from the first Sunday on or after March 1 to
+# May 31, Gregorian.  (JD 0 was a Monday.)
+
+def year_window(year):
+    march_1 = computus.gregorian_to_jd((year, 3, 1))
+    return (march_1 + (6 - march_1) % 7,
+            computus.gregorian_to_jd((year, 5, 31)))
+
+# The first and last JDs of each of the calendars year_calendars builds,
+# worked out without building them.
+
+def calendar_spans(year):
+    hebrew_year = hebrew.hebrew_year(hebrew.ad_to_am_at_pesach(year))
+    return ((computus.gregorian_to_jd((year, 2, 1)),
+                computus.gregorian_to_jd((year, 6, 1)) - 1),
+            (computus.julian_to_jd((year, 2, 1)),
+                computus.julian_to_jd((year, 6, 1)) - 1),
+            (hebrew_year.shevat, hebrew_year.tamuz - 1))
+
+# Whether we can draw a year's page at all.  Far enough from the present, the
+# Julian spring (or the Hebrew one) drifts away from the Gregorian window, and
+# the calendars no longer cover it.
+
+def renderable(year):
+    (start_date, end_date) = year_window(year)
+    for (first_jd, last_jd) in calendar_spans(year):
+        if start_date < first_jd or end_date > last_jd: return False
+    return True
+
+# The Gregorian, Julian and Hebrew calendars for the spring of a year.
+
+def year_calendars(year):
+    with timing.stage('gregorian_calendar'):
+        gregorian = gregorian_calendar(year)
+    with timing.stage('julian_calendar'):
+        julian = julian_calendar(year)
+    with timing.stage('hebrew_calendar'):
+        hebrew_cal = hebrew_calendar(hebrew.ad_to_am_at_pesach(year))
+    return (gregorian, julian, hebrew_cal)
+
+# Render the table rows for the days from start_date to end_date, starting
+# from the first Sunday.  All three calendars must cover the whole window.
+
+def render_window(start_date, end_date, calendars, index, out=None):
+    for row in window_rows(start_date, end_date, calendars, index):
+        print >>out, row,
+
+# The same, as a generator of rows, each of which closes the row before it.
+
+def window_rows(start_date, end_date, calendars, index):
+    gregorian = calendars[0]
+
+    # Find Sunday.
+    first_date = start_date
+    while gregorian[first_date][3] != 0: first_date += 1
+
+    row = cStringIO.StringIO()
+    for jd in range(first_date, end_date + 1):
+        if gregorian[jd][3] == 0 and row.tell():
+            yield row.getvalue()
+            row = cStringIO.StringIO()
+        if gregorian[jd][3] == 0:
+            print >>row, '</tr>'
+            print >>row, '<tr>'
+        render_day(jd, calendars, index, jd == end_date, row)
+    yield row.getvalue()
+
+def render_day(jd, calendars, index, last, out=None):
+    (gregorian, julian, hebrew_cal) = calendars
+    print >>out, '<td height="100" valign="top">'
+    print >>out, str(jd) + '<br>'
+    if last:
+        print >>out, 'Done!<br>'
+    print >>out, 'G',
+    print_calendar_entry(gregorian[jd], out)
+    print >>out, '<br>'
+    print >>out, 'J',
+    print_calendar_entry(julian[jd], out)
+    print >>out, '<br>'
+    print >>out, 'H',
+    print_hebrew_calendar_entry(hebrew_cal[jd], gregorian[jd][3], out)
+    print >>out, '<br>'
+    annotations = consult_compendium(index, jd)
+    j_easter = False
+    j_pre_easter = False
+    for a in annotations:
+        if a == 'gregorian_equinox': print >>out, 'Equinox (W)'
+        elif a == 'gregorian_full_moon': print >>out, 'Full Moon (W)'
+        elif a == 'gregorian_easter': print >>out, 'Easter (W)'
+        elif a == 'julian_equinox': print >>out, 'Equinox (E)'
+        elif a == 'julian_full_moon': print >>out, 'Full Moon (E)'
+        elif a == 'julian_easter':
+            print >>out, 'Easter (E)'
+            j_easter = True
+        elif a == 'julian_uncorrected_easter': j_pre_easter = True
+        elif a == 'passover': print >>out, 'Passover'
+        elif a == 'passover_prep': print >>out, 'Full Moon (H)'
+    if j_pre_easter and not j_easter: print >>out, 'Not Easter (E)'
+    print >>out, '</td>'
+
+def consult_compendium(index, jd):
+    return index.get(jd, [])
 
 def easter_compendium(year):
     gregorian_data = computus.gregorian_easter(year)
@@ -124,19 +369,72 @@ def easter_compendium(year):
     for key in julian_data: compendium[key] = julian_data[key]
     return compendium
 
+# Every key of the compendium that names a day, in the order we want to hear
+# about them when several fall on the same day.
+
+annotation_keys = [
+        'gregorian_equinox', 'gregorian_new_moon', 'gregorian_full_moon',
+        'gregorian_easter', 'julian_equinox', 'julian_new_moon',
+        'julian_full_moon', 'julian_easter', 'julian_uncorrected_easter',
+        'nissan', 'passover_prep', 'passover' ]
+
+# Turn the compendia for some years inside out, into a dict from each JD to
+# the keys that fall on it, so that each day takes one lookup.  Pass an
+# existing index to add more years to it.
+
+def compendium_index(years, index=None):
+    if index is None: index = {}
+    for year in years:
+        compendium = easter_compendium(year)
+        for key in annotation_keys:
+            index.setdefault(compendium[key], []).append(key)
+    return index
+
+# A run of consecutive days, one entry per day, each entry beginning with its
+# JD.  Index it by JD, not by position.
+
+class JDCalendar(object):
+    __slots__ = ('base_jd', 'entries')
+
+    def __init__(self, entries):
+        self.base_jd = entries[0][0]
+        self.entries = entries
+
+    def __getitem__(self, jd):
+        i = jd - self.base_jd
+        if i < 0 or i >= len(self.entries):
+            raise IndexError('JD %d is not in this calendar' % jd)
+        return self.entries[i]
+
+    def __contains__(self, jd):
+        return 0 <= jd - self.base_jd < len(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def first_jd(self):
+        return self.base_jd
+
+    def last_jd(self):
+        return self.base_jd + len(self.entries) - 1
+
 hebrew_month_names = [ 'Shevat', 'Adar', 'Adar I', 'Adar II', 'Nissan',
         'Iyar', 'Sivan' ]
 
 def hebrew_calendar(year):
-    is_leap = hebrew.is_leap(year)
+    hebrew_year = hebrew.hebrew_year(year)
+    is_leap = hebrew_year.leap
 
-    jd = hebrew.shevat_jd(year)
-    adar_jd = hebrew.adar_jd(year)
-    adar_i_jd = hebrew.adar_i_jd(year)
-    nisan_jd = hebrew.nisan_jd(year)
-    iyar_jd = hebrew.iyar_jd(year)
-    sivan_jd = hebrew.sivan_jd(year)
-    tamuz_jd = hebrew.tamuz_jd(year)
+    jd = hebrew_year.shevat
+    adar_jd = hebrew_year.adar
+    adar_i_jd = hebrew_year.adar_i
+    nisan_jd = hebrew_year.nisan
+    iyar_jd = hebrew_year.iyar
+    sivan_jd = hebrew_year.sivan
+    tamuz_jd = hebrew_year.tamuz
 
     calendar = []
     day = 1
@@ -169,7 +467,7 @@ def hebrew_calendar(year):
         else:
             day += 1
     
-    return calendar
+    return JDCalendar(calendar)
 
 def julian_calendar(year):
     return calendar(
@@ -227,17 +525,20 @@ def calendar(initial_jd, year_data, leap):
         phase = phase % 8
         jd += 1
 
-    return calendar
+    return JDCalendar(calendar)
 
-def print_calendar_entry(entry):
+def print_calendar_entry(entry, out=None):
     (jd, month, day, weekday, phase) = entry
     mon_name = computus.months[month]
-    print '%s %d' % (mon_name, day)
+    print >>out, '%s %d' % (mon_name, day)
 
-def print_hebrew_calendar_entry(entry, weekday):
+def print_hebrew_calendar_entry(entry, weekday, out=None):
     (jd, month, day, phase) = entry
     mon_name = hebrew_month_names[month]
-    print '%d %s' % (day, mon_name)
+    print >>out, '%d %s' % (day, mon_name)
+
+def print_calendar(calendar, out=None):
+    for entry in calendar: print_calendar_entry(entry, out)
 
-def print_calendar(calendar):
-    for entry in calendar: print_calendar_entry(entry)
+if __name__ == '__main__':
+    serve(*[ int(arg) for arg in sys.argv[1:2] ])
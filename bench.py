@@ -0,0 +1,238 @@
+# Benchmarks for the hot paths: the computus, the Hebrew calendar, page
+# rendering, and the solar raster.
+#
+# Each workload runs in a process of its own, forked (or, for solar.py, which
+# is Python 3, spawned) fresh from the same starting point, with every cache
+# emptied before each repetition.  We report the first, fastest and median
+# times, and the peak resident memory of that process over and above an idle
+# one.  Results can be saved as JSON, and compared against a saved baseline:
+# anything slower than the baseline by more than the threshold is a
+# regression, and makes us exit with status 1.
+#
+# Usage: python bench.py [--only NAME,...] [--repeat N] [--scales 1,2]
+#                        [--save FILE] [--baseline FILE] [--threshold 0.1]
+
+import antikythera
+import computus
+import hebrew
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+def clear_caches():
+    computus.year_table_cache.clear()
+    computus.gregorian_cycle_cache.clear()
+    hebrew.hebrew_year_cache.clear()
+    antikythera.page_cache.clear()
+
+
+############
+# Workloads.
+
+def gregorian_easter():
+    for year in xrange(1, 10001): computus.gregorian_easter(year)
+
+def julian_easter():
+    for year in xrange(1, 10001): computus.julian_easter(year)
+
+def gregorian_easter_table():
+    for year in xrange(1, 2001):
+        computus.gregorian_easter(year, engine=computus.table_easter)
+
+def easter_many():
+    years = range(1, 100001)
+    computus.gregorian_easter_many(years)
+    computus.julian_easter_many(years)
+
+def generic_year():
+    for year_dom in range(1, 8):
+        for year_epact in range(30):
+            computus.generic_year(year_dom, year_epact, False)
+
+def pesach_jd():
+    for year in xrange(3761, 13761): hebrew.pesach_jd(year)
+
+def shevat_jd():
+    for year in xrange(3761, 13761): hebrew.shevat_jd(year)
+
+def calendar():
+    for year in xrange(1600, 2600):
+        antikythera.gregorian_calendar(year)
+        antikythera.julian_calendar(year)
+
+def hebrew_calendar():
+    for year in xrange(5360, 6360): antikythera.hebrew_calendar(year)
+
+def interleave():
+    for year in xrange(1900, 2000): antikythera.render_year(year)
+
+workloads = [
+        gregorian_easter, julian_easter, gregorian_easter_table, easter_many,
+        generic_year, pesach_jd, shevat_jd, calendar, hebrew_calendar,
+        interleave ]
+
+if computus.numpy is None: workloads.remove(easter_many)
+
+solar_script = '''
+import sys, time
+import solar
+start = time.time()
+solar.render_raster(int(sys.argv[1]))
+print(time.time() - start)
+'''
+
+
+########################
+# Running the workloads.
+
+# Run a workload in a forked child, which reports its timings back through a
+# pipe.  Its resource usage comes back to us from wait4.
+
+def run_forked(workload, repeat):
+    (read_fd, write_fd) = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        times = []
+        for i in range(repeat):
+            clear_caches()
+            start = time.time()
+            if workload: workload()
+            times += [ time.time() - start ]
+        os.write(write_fd, json.dumps(times))
+        os._exit(0)
+    os.close(write_fd)
+    output = ''
+    while True:
+        data = os.read(read_fd, 65536)
+        if not data: break
+        output += data
+    os.close(read_fd)
+    (pid, status, usage) = os.wait4(pid, 0)
+    if status != 0: raise RuntimeError('workload failed')
+    return (json.loads(output), usage.ru_maxrss)
+
+def run_solar(python3, scale_factor, repeat):
+    times = []
+    peak = 0
+    for i in range(repeat):
+        child = subprocess.Popen(
+                [ python3, '-c', solar_script, str(scale_factor) ],
+                stdout=subprocess.PIPE,
+                cwd=os.path.dirname(os.path.abspath(__file__)))
+        output = child.stdout.read()
+        (pid, status, usage) = os.wait4(child.pid, 0)
+        if status != 0: raise RuntimeError('solar.py failed')
+        times += [ float(output) ]
+        peak = max(peak, usage.ru_maxrss)
+    return (times, peak)
+
+def summarize(times, peak_kb, idle_kb):
+    ordered = sorted(times)
+    return {
+            'first' : times[0],
+            'min' : ordered[0],
+            'median' : ordered[len(ordered) / 2],
+            'repeat' : len(times),
+            'peak_kb' : max(0, peak_kb - idle_kb)
+            }
+
+def run(only, repeat, scales, python3):
+    results = {}
+    idle_kb = run_forked(None, 1)[1]
+    for workload in workloads:
+        name = workload.__name__
+        if only and name not in only: continue
+        (times, peak_kb) = run_forked(workload, repeat)
+        results[name] = summarize(times, peak_kb, idle_kb)
+        report(name, results[name])
+
+    # Only start Python 3 if there's a solar workload to run in it.
+
+    solar_scales = [ scale_factor for scale_factor in scales
+            if not only or solar_name(scale_factor) in only ]
+    if solar_scales: idle_kb = solar_idle_kb(python3)
+    for scale_factor in solar_scales:
+        name = solar_name(scale_factor)
+        (times, peak_kb) = run_solar(python3, scale_factor, repeat)
+        results[name] = summarize(times, peak_kb, idle_kb)
+        report(name, results[name])
+    return results
+
+def solar_name(scale_factor):
+    return 'solar_raster_%d' % scale_factor
+
+def solar_idle_kb(python3):
+    child = subprocess.Popen([ python3, '-c', 'import solar' ],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    (pid, status, usage) = os.wait4(child.pid, 0)
+    return usage.ru_maxrss
+
+def report(name, result):
+    print '%-24s min %8.4fs  median %8.4fs  first %8.4fs  peak %8d KB' % (
+            name, result['min'], result['median'], result['first'],
+            result['peak_kb'])
+    sys.stdout.flush()
+
+
+###############################
+# Comparing against a baseline.
+
+# We compare the fastest times, which are the least noisy.  Workloads missing
+# from either side are skipped.
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline: continue
+        old = baseline[name]['min']
+        new = results[name]['min']
+        change = (new - old) / old if old else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += [ name ]
+        print '%-24s %8.4fs -> %8.4fs  %+6.1f%%%s' % (
+                name, old, new, 100 * change, flag)
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run the benchmarks.')
+    parser.add_argument('--only', default='',
+            help='comma-separated workload names')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scales', default='1,2',
+            help='comma-separated SCALE_FACTORs for the solar raster')
+    parser.add_argument('--python3', default='python3')
+    parser.add_argument('--save')
+    parser.add_argument('--baseline')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    only = set(name for name in args.only.split(',') if name)
+    scales = [ int(scale) for scale in args.scales.split(',') if scale ]
+    results = run(only, args.repeat, scales, args.python3)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                    'python' : platform.python_version(),
+                    'machine' : platform.machine(),
+                    'time' : time.time(),
+                    'results' : results
+                    }, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        print
+        if compare(results, baseline, args.threshold): return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,104 @@
+# Caches: a small least-recently-used one in memory, and one on disk.
+#
+# Everything we compute is a pure function of a handful of small inputs, so
+# it's worth hanging on to results in a long-running process.  But not
+# forever, and not without some way to tell whether it's helping: hence the
+# size limit and the hit/miss counters.
+
+import collections
+import os
+import tempfile
+import threading
+
+
+class LRUCache(object):
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    # Look up key, calling compute() to fill it in if it's missing.  Two
+    # threads may occasionally compute the same value, but since the values
+    # are pure functions of the key, it doesn't matter which one wins.
+
+    def fetch(self, key, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.entries[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            while self.entries and len(self.entries) >= self.maxsize:
+                self.entries.popitem(last=False)
+            if self.maxsize > 0: self.entries[key] = value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {
+                'hits' : self.hits,
+                'misses' : self.misses,
+                'size' : len(self.entries),
+                'maxsize' : self.maxsize
+                }
+
+    def __len__(self):
+        return len(self.entries)
+
+
+# Somewhere on disk to keep things between runs, or to share them between
+# processes.  Keys become file names, so they had better be tame.  Values are
+# strings, written to a temporary file and renamed into place so that a reader
+# never sees half of one.
+
+class DiskCache(object):
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory): os.makedirs(directory)
+
+    def get(self, key, default=None):
+        try:
+            with open(os.path.join(self.directory, key), 'rb') as f:
+                value = f.read()
+        except IOError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        (fd, temp_path) = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        os.rename(temp_path, os.path.join(self.directory, key))
+
+    def info(self):
+        return {
+                'hits' : self.hits,
+                'misses' : self.misses,
+                'directory' : self.directory
+                }
@@ -6,14 +6,24 @@
 # Cycle" has a misprint: all "+1" indications on or after year 4500 should be
 # 100 years later than shown.  (The text above the table gets it right.)
 
+import cache
 import hebrew
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 ####################################
 # Main entry point for the computus.
 
-def gregorian_easter(year):
-    easter_data = easter(gregorian_year(year))
+# By default we look the year up in a precomputed Paschal cycle (see below).
+# Pass one of the engines instead to do the computus from scratch.
+
+def gregorian_easter(year, engine=None):
+    if engine is None: easter_data = gregorian_cycle_easter(year)
+    else: easter_data = engine(*gregorian_year_parameters(year))
 
     easter_day = gregorian_to_jd((year, ) + easter_data['easter'])
     equinox = gregorian_to_jd((year, ) + easter_data['equinox'])
@@ -27,8 +37,9 @@ def gregorian_easter(year):
             'gregorian_full_moon' : full_moon
             }
 
-def julian_easter(year):
-    easter_data = easter(julian_year(year))
+def julian_easter(year, engine=None):
+    if engine is None: easter_data = julian_cycle_easter(year)
+    else: easter_data = engine(*julian_year_parameters(year))
     presumptive_easter = julian_to_jd((year, ) + easter_data['easter'])
     equinox = julian_to_jd((year, ) + easter_data['equinox'])
     new_moon = julian_to_jd((year, ) + easter_data['new_moon'])
@@ -36,7 +47,7 @@ def julian_easter(year):
 
     easter_day = presumptive_easter
     needed_passover_correction = False
-    while (passover_begins > presumptive_easter):
+    while (passover_begins > easter_day):
         needed_passover_correction = True
         easter_day += 7
 
@@ -52,6 +63,18 @@ def julian_easter(year):
             'nissan' : passover_begins - 14
             }
 
+# There are three interchangeable engines for the computus proper.  All three
+# take the year's (second) Dominical Letter, its epact, and Lilius's hack25
+# flag (see gregorian_year, below), and all three return the same dict of
+# (month, day) pairs.  The table engine builds the whole liturgical year and
+# walks it, which is the easiest way to convince yourself that it's right.  The
+# arithmetic engine reads the same three entries straight off the shape of the
+# calendarium, without building anything.  The tabulated engine just looks the
+# answer up in a table of every possible year (see below).
+
+def table_easter(year_dom, year_epact, hack25):
+    return easter(cached_year(year_dom, year_epact, hack25))
+
 def easter(year_data):
     i_vernal_equinox = find_vernal_equinox(year_data)
     i_paschal_new_moon = find_new_moon_after(i_vernal_equinox - 13, year_data)
@@ -67,14 +90,66 @@ def easter(year_data):
             'new_moon': year_data[i_paschal_new_moon][0:2]
             }
 
+def arithmetic_easter(year_dom, year_epact, hack25):
+    i_vernal_equinox = day_of_year(3, 21)
+    i_paschal_new_moon = day_of_year(
+            *paschal_new_moon(year_epact, hack25))
+    i_paschal_full_moon = i_paschal_new_moon + 14
+    i_easter = first_sunday_after(i_paschal_full_moon, year_dom)
+    return {
+            'easter': day_of_year_to_date(i_easter),
+            'equinox': day_of_year_to_date(i_vernal_equinox),
+            'new_moon': day_of_year_to_date(i_paschal_new_moon)
+            }
+
+# The Paschal new moon is the first one on or after March 8, i.e. the first
+# one whose full moon can fall on or after the equinox.  In March the
+# calendarium labels day d with epact (1 - d) mod 30, so epacts 23 down to *
+# land on March 8 through March 31.  April is a "hollow" month, so its epact
+# 25 and 24 share April 5, and the special 25 label of hack25 sits with 26 on
+# April 4.  (Run build_calendarium and look, if you don't believe it.)
+
+def paschal_new_moon(year_epact, hack25):
+    if hack25: return (4, 4)
+    if year_epact <= 23: return (3, 31 - year_epact)
+    if year_epact == 24: return (4, 5)
+    return (4, 30 - year_epact)
 
-########################################
-# Boring functions to scan the calendar.
+# A day of the calendarium is a Sunday when its Dominical Letter is the year's
+# Dominical Letter.  Day 0 (January 1) is always letter A.
+
+def first_sunday_after(i, year_dom):
+    return i + (year_dom - 1 - i) % 7
+
+# Days of the year, counted from 0, as indices into the (leap-day-free)
+# liturgical year.
+
+def day_of_year(month, day):
+    i = day - 1
+    for m in range(1, month): i += month_length(m)
+    return i
+
+def day_of_year_to_date(i):
+    month = 1
+    while i >= month_length(month):
+        i -= month_length(month)
+        month += 1
+    return (month, i + 1)
+
+
+##############################################
+# Boring functions to look things up in a year.
+
+# A YearTable (see below) has all the answers precomputed, so we just ask it.
+# Any other list of (month, day, weekday, new_moon), such as generic_year
+# returns, we walk one day at a time, the way we always used to.
 
 def find_vernal_equinox(year_data):
     return find_day(year_data, 3, 21)
 
 def find_day(year_data, target_month, target_day):
+    if isinstance(year_data, YearTable):
+        return year_data.find_day(target_month, target_day)
     i = 0
     while 1:
         (month, day, weekday, new_moon) = year_data[i]
@@ -82,12 +157,16 @@ def find_day(year_data, target_month, target_day):
         i = i + 1
 
 def find_new_moon_after(i, year_data):
+    if isinstance(year_data, YearTable):
+        return year_data.find_new_moon_after(i)
     while 1:
         (month, day, weekday, new_moon) = year_data[i]
         if new_moon: return i
         i = i + 1
 
 def find_first_sunday_after(i, year_data):
+    if isinstance(year_data, YearTable):
+        return year_data.find_first_sunday_after(i)
     while 1:
         (month, day, weekday, new_moon) = year_data[i]
         if weekday == 0: return i
@@ -279,6 +358,12 @@ def solar_number(year):
 # February 24 is doubled, its moon phase is doubled with it.
 
 def gregorian_year(year):
+    return cached_year(*gregorian_year_parameters(year))
+
+def julian_year(year):
+    return cached_year(*julian_year_parameters(year))
+
+def gregorian_year_parameters(year):
     year_dom = second_gregorian_dominical(year)
     year_epact = gregorian_epact(year)
 
@@ -288,13 +373,13 @@ def gregorian_year(year):
     # moon.
 
     hack25 = (year_epact == 25 and golden_number(year) > 11)
-    return generic_year(year_dom, year_epact, hack25)
+    return (year_dom, year_epact, hack25)
 
-def julian_year(year):
+def julian_year_parameters(year):
     year_dom = second_julian_dominical(year)
     # TODO: I have no idea why the -2 is necessary.
     year_epact = metonic_epact(year - 2)
-    return generic_year(year_dom, year_epact, hack25 = False)
+    return (year_dom, year_epact, False)
 
 def generic_year(year_dom, year_epact, hack25):
     days = []
@@ -324,20 +409,131 @@ def generic_year(year_dom, year_epact, hack25):
     days += [(this_month, this_day, this_weekday, this_new_moon)]
     return days
 
+# A year depends only on its Dominical Letter (7 possibilities), its epact (30)
+# and hack25 (which only matters for epact 25), so there are just 217 distinct
+# years.  We build each one once and hand out the same copy to everybody who
+# asks for it, which is safe because a YearTable keeps all its columns in
+# tuples, which nobody can change.
+
+year_table_cache = cache.LRUCache(256)
+
+def cached_year(year_dom, year_epact, hack25):
+    key = (year_dom, year_epact, bool(hack25))
+    return year_table_cache.fetch(
+            key, lambda: YearTable(generic_year(*key)))
+
+# A year, stored as columns rather than as a list of (month, day, weekday,
+# new_moon) tuples, though it still looks like that list if you index it or
+# iterate over it.  Each column is a string of one byte per day: compact, and
+# immutable, so that cached_year can safely hand the same table to everybody.
+# Every year has the same months and days, so those columns (and where each
+# month starts) are shared by all tables; each table only keeps its own
+# weekdays and new moons.  It also remembers, for each day, how many days it
+# is from there to the next new moon and to the next Sunday (or none_after if
+# there isn't one before the end of the year), so the find_* functions above
+# never have to scan.
+
+none_after = 255
+
+class YearTable(object):
+    __slots__ = ('weekdays', 'new_moons', 'next_new_moons', 'next_sundays')
+
+    months = None
+    days = None
+    month_starts = None
+    month_lengths = None
+
+    def __init__(self, year_data):
+        if YearTable.months is None:
+            months = [ d[0] for d in year_data ]
+            YearTable.days = byte_column([ d[1] for d in year_data ])
+            YearTable.month_starts = tuple(
+                    months.index(m) if m in months else -1
+                    for m in range(13))
+            YearTable.month_lengths = tuple(months.count(m)
+                    for m in range(13))
+            YearTable.months = byte_column(months)
+
+        self.weekdays = byte_column([ d[2] for d in year_data ])
+        self.new_moons = byte_column([ d[3] for d in year_data ])
+        self.next_new_moons = next_occurrences(
+                [ d[3] for d in year_data ])
+        self.next_sundays = next_occurrences(
+                [ d[2] == 0 for d in year_data ])
+
+    def __len__(self):
+        return len(self.weekdays)
+
+    def __getitem__(self, i):
+        return (ord(self.months[i]), ord(self.days[i]),
+                ord(self.weekdays[i]), self.new_moons[i] != '\0')
+
+    def __iter__(self):
+        for i in range(len(self)): yield self[i]
+
+    def find_day(self, target_month, target_day):
+        if not (0 < target_month < len(self.month_lengths) and
+                0 < target_day <= self.month_lengths[target_month]):
+            raise KeyError((target_month, target_day))
+        return self.month_starts[target_month] + target_day - 1
+
+    def find_new_moon_after(self, i):
+        return found(i % len(self), self.next_new_moons)
+
+    def find_first_sunday_after(self, i):
+        return found(i % len(self), self.next_sundays)
+
+def byte_column(values):
+    return ''.join(chr(value) for value in values)
+
+# How far it is from each day to the next one flagged, as a byte column.
+
+def next_occurrences(flags):
+    following = [ none_after ] * len(flags)
+    next_i = None
+    for i in range(len(flags) - 1, -1, -1):
+        if flags[i]: next_i = i
+        if next_i is not None: following[i] = next_i - i
+    return byte_column(following)
+
+def found(i, distances):
+    distance = ord(distances[i])
+    if distance == none_after: raise IndexError('ran off the end of the year')
+    return i + distance
+
 def julian_to_gregorian(date):
     return jd_to_gregorian(julian_to_jd(date))
 
+# These use nothing but integer arithmetic, so they work just as well when
+# year, month and day are NumPy arrays.  (In JD terms a year begins on March
+# 1, which puts the leap day at the end where it can't hurt anybody.)
+
 def julian_to_jd((year, month, day)):
-    return 367 * year - int(7 * (year + 5001 + int((month - 9) / 7.0)) / 4.0) \
-            + int(275 * month / 9.0) + day + 1729777
+    a = (14 - month) / 12
+    y = year + 4800 - a
+    m = month + 12 * a - 3
+    return day + (153 * m + 2) / 5 + 365 * y + y / 4 - 32083
 
 def gregorian_to_jd((year, month, day)):
-    return 367 * year - int(7 * (year + int((month + 9) / 12.0)) / 4.0) \
-            - int(3 * (int((year + (month - 9) / 7.0) / 100.0) + 1) / 4.0) \
-            + int(275 * month / 9.0) + day + 1721029
+    a = (14 - month) / 12
+    y = year + 4800 - a
+    m = month + 12 * a - 3
+    return day + (153 * m + 2) / 5 + 365 * y + y / 4 - y / 100 + y / 400 \
+            - 32045
 
 def jd_to_julian(jd):
-    raise 'wheeeee!'
+    j = jd + 32082
+    b = j / 1461
+    db = j % 1461
+    a = (db / 365 + 1) * 3 / 4
+    da = db - a * 365
+    y = b * 4 + a
+    m = (da * 5 + 308) / 153 - 2
+    d = da - (m + 4) * 153 / 5 + 122
+    year = y - 4800 + (m + 2) / 12
+    month = (m + 2) % 12 + 1
+    day = d + 1
+    return (year, month, day)
 
 def jd_to_gregorian(jd):
     j = jd + 32044
@@ -358,6 +554,190 @@ def jd_to_gregorian(jd):
     return (year, month, day)
 
 
+####################
+# The Paschal cycles.
+
+# Since a year's Easter depends only on its Dominical Letter, epact and
+# hack25, we can work out all 217 possible answers once and for all.
+
+paschal_table = dict(
+        ((year_dom, year_epact, hack25),
+            arithmetic_easter(year_dom, year_epact, hack25))
+        for year_dom in range(1, 8)
+        for year_epact in range(30)
+        for hack25 in ([ False, True ] if year_epact == 25 else [ False ]))
+
+def tabulated_easter(year_dom, year_epact, hack25):
+    return paschal_table[(year_dom, year_epact, bool(hack25))]
+
+# Better yet, the Julian epact repeats every 19 years and the Julian Dominical
+# Letter every 28, so the whole Julian computus repeats every 532 years.  This
+# is the Great Paschal Cycle of Dionysius Exiguus.
+
+julian_paschal_cycle = [ paschal_table[julian_year_parameters(year)]
+        for year in range(532) ]
+
+def julian_cycle_easter(year):
+    return julian_paschal_cycle[year % 532]
+
+# The Gregorian computus repeats only every 5,700,000 years, but it's
+# periodic in shorter bursts.  The lunar and solar equations only ever change
+# at the turn of a century, and so does the century term of the Dominical
+# Letter.  Within a century, then, the Gregorian computus follows a 532-year
+# cycle of its own, determined by the sum of the equations (mod 30) and the
+# century's shift of the Dominical Letter (mod 7).  There are only 210 such
+# epochs, and we build their cycles as they're needed.
+
+gregorian_cycle_cache = cache.LRUCache(32)
+
+def gregorian_cycle_easter(year):
+    epoch = gregorian_epoch(year / 100)
+    cycle = gregorian_cycle_cache.fetch(
+            epoch, lambda: gregorian_paschal_cycle(*epoch))
+    return cycle[year % 532]
+
+def gregorian_epoch(century):
+    year = century * 100
+    correction = lunar_equation(year) + solar_equation(year)
+    c = century - 16
+    return (correction % 30, (c / 4 - c) % 7)
+
+# This is gregorian_year_parameters with the century terms factored out.
+
+def gregorian_paschal_cycle(correction, dominical_shift):
+    cycle = []
+    for year in range(532):
+        year_dom = 7 - (year + 1 + year / 4 + dominical_shift) % 7
+        year_epact = (base_greg_epact(year) + correction) % 30
+        hack25 = (year_epact == 25 and golden_number(year) > 11)
+        cycle += [ paschal_table[(year_dom, year_epact, hack25)] ]
+    return cycle
+
+
+##################################################
+# The computus over whole arrays of years at once.
+
+# These return the same keys as gregorian_easter and julian_easter, but each
+# value is an array with one entry per requested year.  They need NumPy; the
+# scalar versions above don't.  Every date involved falls on or after March 1,
+# so we can work in days of the liturgical year and convert to JD with a
+# single offset from March 1, without worrying about the leap day.
+
+def gregorian_easter_many(years):
+    years = numpy.asarray(years, dtype=numpy.int64)
+    golden = golden_number_many(years)
+    epact = (metonic_cycle_array[golden] + 1 + lunar_equation(years) +
+            solar_equation_many(years)) % 30
+    hack25 = (epact == 25) & (golden > 11)
+    year_dom = second_gregorian_dominical(years)
+
+    data = easter_days_many(year_dom, epact, hack25)
+    march_1 = gregorian_to_jd((years, 3, 1)) - day_of_year(3, 1)
+    new_moon = march_1 + data['new_moon']
+
+    return {
+            'gregorian_easter' : march_1 + data['easter'],
+            'gregorian_equinox' : march_1 + data['equinox'],
+            'gregorian_new_moon' : new_moon,
+            'gregorian_full_moon' : new_moon + 13
+            }
+
+def julian_easter_many(years):
+    years = numpy.asarray(years, dtype=numpy.int64)
+    epact = metonic_cycle_array[golden_number_many(years - 2)]
+    year_dom = julian_dominical_array[(years + 8) % 28 + 1]
+
+    data = easter_days_many(year_dom, epact, numpy.zeros_like(years, bool))
+    march_1 = julian_to_jd((years, 3, 1)) - day_of_year(3, 1)
+    presumptive_easter = march_1 + data['easter']
+    new_moon = march_1 + data['new_moon']
+    passover_begins = hebrew.pesach_jd_many(hebrew.ad_to_am_at_pesach(years))
+
+    # Move Easter forward by as many weeks as it takes to clear Passover.
+
+    late = numpy.maximum(passover_begins - presumptive_easter, 0)
+    easter_day = presumptive_easter + 7 * ((late + 6) / 7)
+
+    return {
+            'julian_easter' : easter_day,
+            'julian_uncorrected_easter' : presumptive_easter,
+            'julian_equinox' : march_1 + data['equinox'],
+            'julian_new_moon' : new_moon,
+            'julian_full_moon' : new_moon + 13,
+            'julian_passover_correction' : late > 0,
+            'passover' : passover_begins,
+            'passover_prep' : passover_begins - 1,
+            'nissan' : passover_begins - 14
+            }
+
+# This is arithmetic_easter, but returning days of the year rather than
+# (month, day) pairs.
+
+def easter_days_many(year_dom, year_epact, hack25):
+    i_vernal_equinox = day_of_year(3, 21)
+    i_paschal_new_moon = numpy.where(hack25,
+            day_of_year(*paschal_new_moon(25, True)),
+            paschal_new_moon_array[year_epact])
+    i_paschal_full_moon = i_paschal_new_moon + 14
+    i_easter = i_paschal_full_moon + (year_dom - 1 - i_paschal_full_moon) % 7
+    return {
+            'easter': i_easter,
+            'equinox': numpy.full_like(i_easter, i_vernal_equinox),
+            'new_moon': i_paschal_new_moon
+            }
+
+def golden_number_many(years):
+    r = (1 + years) % 19
+    return numpy.where(r == 0, 19, r)
+
+def solar_equation_many(years):
+    d = (years - 1600) / 400
+    r = (years - 1600) % 400
+    return numpy.where(years < 1600, 0, (-3 * d) - (r / 100))
+
+# Calendar conversions for arrays of dates.  Dates come and go as structured
+# arrays with year, month and day fields, so a caller can hand us a column
+# of some bigger record array, and pull the fields back out, without copying.
+
+def gregorian_to_jd_many(dates):
+    dates = as_date_array(dates)
+    return gregorian_to_jd((dates['year'], dates['month'], dates['day']))
+
+def julian_to_jd_many(dates):
+    dates = as_date_array(dates)
+    return julian_to_jd((dates['year'], dates['month'], dates['day']))
+
+def jd_to_gregorian_many(jds):
+    return date_array(jd_to_gregorian(numpy.asarray(jds, dtype=numpy.int64)))
+
+def jd_to_julian_many(jds):
+    return date_array(jd_to_julian(numpy.asarray(jds, dtype=numpy.int64)))
+
+def as_date_array(dates):
+    if isinstance(dates, numpy.ndarray) and dates.dtype.names: return dates
+    return numpy.array(dates, dtype=date_dtype)
+
+def date_array((years, months, days)):
+    dates = numpy.empty(len(years), dtype=date_dtype)
+    dates['year'] = years
+    dates['month'] = months
+    dates['day'] = days
+    return dates
+
+# Lookup tables for the above, indexed the same way as their scalar
+# counterparts: by golden number, epact, and solar number, respectively.
+
+if numpy is not None:
+    date_dtype = numpy.dtype([
+            ('year', numpy.int64), ('month', numpy.int64), ('day', numpy.int64)])
+    metonic_cycle_array = numpy.array([0] + metonic_cycle[1:])
+    paschal_new_moon_array = numpy.array(
+            [ day_of_year(*paschal_new_moon(epact, False))
+                for epact in range(30) ])
+    julian_dominical_array = numpy.array(
+            [0] + [ second_julian_dominical(year - 9) for year in range(1, 29) ])
+
+
 ##################
 # Output niceties.
 
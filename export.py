@@ -0,0 +1,90 @@
+# Export the computed calendars in machine-readable form: one row per year,
+# with both Easters, Passover, and the start of every Hebrew month, as
+# newline-delimited JSON or CSV.  Everything is a generator, so the rows are
+# written out as they're computed, however many years you ask for.
+#
+# Usage: python export.py [--format ndjson|csv] [--output FILE] FIRST LAST
+
+import computus
+import hebrew
+
+import argparse
+import collections
+import cStringIO
+import csv
+import json
+import sys
+
+gregorian_columns = [
+        'gregorian_easter', 'gregorian_equinox', 'gregorian_new_moon',
+        'gregorian_full_moon' ]
+
+julian_columns = [
+        'julian_easter', 'julian_uncorrected_easter', 'julian_equinox',
+        'julian_new_moon', 'julian_full_moon', 'julian_passover_correction',
+        'passover', 'passover_prep', 'nissan' ]
+
+hebrew_columns = [
+        'tishrei', 'cheshvan', 'kislev', 'tevet', 'shevat', 'adar_i', 'adar',
+        'nisan', 'iyar', 'sivan', 'tamuz', 'av', 'elul' ]
+
+columns = ([ 'year', 'hebrew_year' ] + gregorian_columns + julian_columns +
+        hebrew_columns)
+
+# The Hebrew year is the one whose Passover falls in the given year, so its
+# months run from the previous autumn to this one.
+
+def year_row(year):
+    gregorian_data = computus.gregorian_easter(year)
+    julian_data = computus.julian_easter(year)
+    hebrew_year = hebrew.hebrew_year(hebrew.ad_to_am_at_pesach(year))
+    return ([ year, hebrew_year.year ] +
+            [ gregorian_data[key] for key in gregorian_columns ] +
+            [ julian_data[key] for key in julian_columns ] +
+            [ getattr(hebrew_year, key) for key in hebrew_columns ])
+
+def rows(first_year, last_year):
+    for year in xrange(first_year, last_year + 1):
+        yield year_row(year)
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(collections.OrderedDict(zip(columns, row))) + '\n'
+
+def csv_lines(rows, header=True):
+    buf = cStringIO.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    if header: writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+formats = {
+        'ndjson' : (ndjson_lines, 'application/x-ndjson'),
+        'csv' : (csv_lines, 'text/csv')
+        }
+
+def lines(first_year, last_year, format):
+    (formatter, content_type) = formats[format]
+    return formatter(rows(first_year, last_year))
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+            description='Export Easter and Passover dates as JDs.')
+    parser.add_argument('first_year', type=int)
+    parser.add_argument('last_year', type=int)
+    parser.add_argument('--format', choices=sorted(formats), default='ndjson')
+    parser.add_argument('--output', '-o', default='-')
+    args = parser.parse_args(argv)
+
+    if args.output == '-': out = sys.stdout
+    else: out = open(args.output, 'wb')
+    for line in lines(args.first_year, args.last_year, args.format):
+        out.write(line)
+    if out is not sys.stdout: out.close()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
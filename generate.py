@@ -0,0 +1,104 @@
+# Generate the export tables for a long span of years on every core.  Each
+# year is independent of every other, so we cut the span into chunks, farm
+# them out to a pool of worker processes, and write their results out in
+# order as they come back.  If the output file already exists, we pick up
+# where it left off, so an interrupted run can just be started again.
+#
+# Usage: python generate.py [--format ndjson|csv] [--jobs N]
+#                           [--chunk-years N] [--quiet] FIRST LAST FILE
+
+import export
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import sys
+
+def chunk_text((first_year, last_year, format)):
+    (formatter, content_type) = export.formats[format]
+    rows = export.rows(first_year, last_year)
+    if format == 'csv': return ''.join(formatter(rows, header=False))
+    return ''.join(formatter(rows))
+
+def chunks(first_year, last_year, chunk_years, format):
+    for start in xrange(first_year, last_year + 1, chunk_years):
+        yield (start, min(start + chunk_years - 1, last_year), format)
+
+# How many years an earlier run managed to write.  Anything after the last
+# complete line is thrown away, since the run died in the middle of writing
+# it.  The file may be huge, so we only ever hold a block of it at a time:
+# we look for the last newline backwards from the end, then count the lines
+# forwards from the start.
+
+def years_written(path, format, block_size=1 << 20):
+    if not os.path.exists(path): return 0
+    with open(path, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        complete = 0
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            newline = f.read(end - start).rfind('\n')
+            if newline >= 0:
+                complete = start + newline + 1
+                break
+            end = start
+        f.truncate(complete)
+
+        f.seek(0)
+        lines = 0
+        while True:
+            block = f.read(block_size)
+            if not block: break
+            lines += block.count('\n')
+    if format == 'csv' and lines > 0: lines -= 1
+    return lines
+
+def generate(path, first_year, last_year, format='ndjson', jobs=None,
+        chunk_years=1000, progress=None):
+    done = years_written(path, format)
+    total = last_year - first_year + 1
+    if done >= total: return
+
+    fresh = not os.path.exists(path) or os.path.getsize(path) == 0
+    with open(path, 'ab') as out:
+        if format == 'csv' and fresh:
+            out.write(','.join(export.columns) + '\n')
+        pool = multiprocessing.Pool(jobs)
+        try:
+            work = list(chunks(first_year + done, last_year, chunk_years,
+                    format))
+            for (chunk, text) in itertools.izip(work,
+                    pool.imap(chunk_text, work)):
+                out.write(text)
+                out.flush()
+                done += chunk[1] - chunk[0] + 1
+                if progress: progress(done, total)
+        finally:
+            pool.terminate()
+
+def report_progress(done, total):
+    sys.stderr.write('\r%d/%d years (%d%%)' % (done, total, 100 * done / total))
+    if done == total: sys.stderr.write('\n')
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+            description='Generate Easter and Passover tables in parallel.')
+    parser.add_argument('first_year', type=int)
+    parser.add_argument('last_year', type=int)
+    parser.add_argument('output')
+    parser.add_argument('--format', choices=sorted(export.formats),
+            default='ndjson')
+    parser.add_argument('--jobs', '-j', type=int, default=None)
+    parser.add_argument('--chunk-years', type=int, default=1000)
+    parser.add_argument('--quiet', '-q', action='store_true')
+    args = parser.parse_args(argv)
+
+    generate(args.output, args.first_year, args.last_year, args.format,
+            args.jobs, args.chunk_years,
+            None if args.quiet else report_progress)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,6 +2,16 @@
 #
 # Reference: http://www.shirhadash.org/calendar/abouthcal.html
 
+import array
+import bisect
+
+import cache
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 ########################
 # Units and conversions.
@@ -48,13 +58,14 @@ def wd_to_jd((weeks, days)):
 # the right number of months since Day 1 (12 or 13 months per year, depending
 # on intercalations)...
 
+metonic_months = [
+          0,  12,  24,  37,  49,  61,  74,  86,  99, 111,
+             123, 136, 148, 160, 173, 185, 197, 210, 222 ]
+
 def months_before_year(year):
     metonic_cycles = ((year - 1) / 19) * 235
     r = (year - 1) % 19
-    months = [
-              0,  12,  24,  37,  49,  61,  74,  86,  99, 111,
-                 123, 136, 148, 160, 173, 185, 197, 210, 222 ]
-    return metonic_cycles + months[r]
+    return metonic_cycles + metonic_months[r]
 
 def molad_tishrei(year):
     return first_moon + months_before_year(year) * month_length
@@ -62,29 +73,32 @@ def molad_tishrei(year):
 # But then there are some rather complex rules by which we can "postpone"
 # Rosh Hashanah if the moon is too late in the day, or if the year would be
 # starting on a "bad" day, i.e. one which would cause certain festivals to
-# fall on forbidden days of the week, later in the year.
+# fall on forbidden days of the week, later in the year.  The first three
+# rules look at the molad itself, and at most one of them applies.  (The
+# second jumps straight from Tuesday to Thursday, since Wednesday is one of
+# the bad days anyway.)  The last rule looks at wherever we've ended up.
 
 def rosh_hashanah(year):
     molad = molad_tishrei(year)
     (weeks, days, hours, halakhim) = halakhim_to_wdhh(molad)
-    if hours > 18:
+    if hours >= 18:
         molad = molad + day_length
-        (weeks, days, hours, halakhim) = halakhim_to_wdhh(molad)
-    if ((not is_leap) and days == 3 and
-            (hours >= 10 or (hours == 9 and halakhim > 204))):
-        molad = molad + day_length
-        (weeks, days, hours, halakhim) = halakhim_to_wdhh(molad)
-    if (is_leap(year) and days == 2 and
-            (hours >= 16 or (hours == 15 and halakhim > 589))):
+    elif ((not is_leap(year)) and days == 3 and
+            (hours >= 10 or (hours == 9 and halakhim >= 204))):
+        molad = molad + 2 * day_length
+    elif (is_leap(year - 1) and days == 2 and
+            (hours >= 16 or (hours == 15 and halakhim >= 589))):
         molad = molad + day_length
-        (weeks, days, hours, halakhim) = halakhim_to_wdhh(molad)
+    (weeks, days, hours, halakhim) = halakhim_to_wdhh(molad)
     if days in [ 1, 4, 6 ]:
         molad = molad + day_length
         (weeks, days, hours, halakhim) = halakhim_to_wdhh(molad)
     return (weeks, days)
 
+leap_years = [ 0, 3, 6, 8, 11, 14, 17 ]
+
 def is_leap(year):
-    return (year % 19) in [ 0, 3, 6, 8, 11, 14, 17 ]
+    return (year % 19) in leap_years
 
 #########
 # Pesach.
@@ -100,43 +114,234 @@ def is_leap(year):
 # them is to just compute next year's Rosh Hashanah and see how many days are
 # between now and then.
 
-length_4 = 30 + 29 + 30 + 29
+length_tishrei = 30
+length_cheshvan = 29
+length_kislev = 30
+length_tevet = 29
+length_4 = length_tishrei + length_cheshvan + length_kislev + length_tevet
 length_shevat = 30
 length_adar_i = 30
 length_adar = 29
 length_nisan = 30
 length_iyar = 29
 length_sivan = 30
+length_tamuz = 29
+length_av = 30
+length_elul = 29
 
 days_to_pesach = 30 + 29 + 30 + 29 + 30 + 29 + 14
 
+# A year's worth of all that, worked out once.  An excessive ("complete") year
+# adds its extra day to Cheshvan, and a defective ("deficient") year takes its
+# missing day from Kislev; after that, every month has a fixed length.
+
+class HebrewYear(object):
+    __slots__ = ('year', 'leap', 'length', 'excess',
+            'tishrei', 'cheshvan', 'kislev', 'tevet', 'shevat', 'adar_i',
+            'adar', 'nisan', 'pesach', 'iyar', 'sivan', 'tamuz', 'av', 'elul')
+
+    def __init__(self, year):
+        rosh_hashanah_jd = wd_to_jd(rosh_hashanah(year))
+        next_rh_jd = wd_to_jd(rosh_hashanah(year + 1))
+
+        self.year = year
+        self.leap = is_leap(year)
+        self.length = next_rh_jd - rosh_hashanah_jd
+        self.excess = self.length - (354 + length_adar_i * self.leap)
+
+        self.tishrei = rosh_hashanah_jd
+        self.cheshvan = self.tishrei + length_tishrei
+        self.kislev = self.cheshvan + length_cheshvan + (self.excess > 0)
+        self.tevet = self.kislev + length_kislev - (self.excess < 0)
+        self.shevat = self.tevet + length_tevet
+        self.adar_i = self.shevat + length_shevat
+        self.adar = self.adar_i + length_adar_i * self.leap
+        self.nisan = self.adar + length_adar
+        self.pesach = self.nisan + 14
+        self.iyar = self.nisan + length_nisan
+        self.sivan = self.iyar + length_iyar
+        self.tamuz = self.sivan + length_sivan
+        self.av = self.tamuz + length_tamuz
+        self.elul = self.av + length_av
+
+    # The first day of each month, in the order of month_names (below).  In
+    # a common year Adar I starts and ends on the first of Adar.
+
+    def month_starts(self):
+        return (self.tishrei, self.cheshvan, self.kislev, self.tevet,
+                self.shevat, self.adar_i, self.adar, self.nisan, self.iyar,
+                self.sivan, self.tamuz, self.av, self.elul)
+
+    def is_deficient(self):
+        return self.excess < 0
+
+    def is_complete(self):
+        return self.excess > 0
+
+    def __repr__(self):
+        return 'HebrewYear(%d)' % self.year
+
+hebrew_year_cache = cache.LRUCache(1024)
+
+def hebrew_year(year):
+    return hebrew_year_cache.fetch(year, lambda: HebrewYear(year))
+
 def shevat_jd(year):
-    rosh_hashanah_jd = wd_to_jd(rosh_hashanah(year))
-    next_rh_jd = wd_to_jd(rosh_hashanah(year + 1))
-    adar_i = length_adar_i * is_leap(year)
-    excess = (next_rh_jd - rosh_hashanah_jd) - (354 + adar_i)
-    return rosh_hashanah_jd + length_4 + excess
+    return hebrew_year(year).shevat
 
 def adar_jd(year):
-    return shevat_jd(year) + length_shevat + (length_adar_i * is_leap(year))
+    return hebrew_year(year).adar
 
 def adar_i_jd(year):
-    return shevat_jd(year) + length_shevat
+    return hebrew_year(year).adar_i
 
 def nisan_jd(year):
-    return adar_jd(year) + length_adar
+    return hebrew_year(year).nisan
 
 def pesach_jd(year):
-    return nisan_jd(year) + 14
+    return hebrew_year(year).pesach
 
 def iyar_jd(year):
-    return nisan_jd(year) + length_nisan
+    return hebrew_year(year).iyar
 
 def sivan_jd(year):
-    return iyar_jd(year) + length_iyar
+    return hebrew_year(year).sivan
 
 def tamuz_jd(year):
-    return sivan_jd(year) + length_sivan
+    return hebrew_year(year).tamuz
+
+#################################
+# Whole arrays of years at once.
+
+# These are rosh_hashanah and pesach_jd for a NumPy array of years, returning
+# an array of JDs.  (Note that rosh_hashanah_many returns JDs, not (weeks,
+# days) pairs.)  The molad is counted in halakhim since Day 1, which fits
+# comfortably in 64 bits for any year anybody cares about.
+
+def rosh_hashanah_many(years):
+    years = numpy.asarray(years, dtype=numpy.int64)
+    molad = first_moon + months_before_year_many(years) * month_length
+    (weeks, days, hours, halakhim) = halakhim_to_wdhh(molad)
+    leap = is_leap_many(years)
+
+    zaken = hours >= 18
+    gatarad = (~zaken & ~leap & (days == 3) &
+            ((hours >= 10) | ((hours == 9) & (halakhim >= 204))))
+    betutakpat = (~zaken & ~gatarad & is_leap_many(years - 1) & (days == 2) &
+            ((hours >= 16) | ((hours == 15) & (halakhim >= 589))))
+    total_days = (weeks * 7 + days +
+            zaken + 2 * gatarad + betutakpat).astype(numpy.int64)
+    total_days += numpy.in1d(total_days % 7, [ 1, 4, 6 ])
+    return total_days + am_epoch
+
+def pesach_jd_many(years):
+    years = numpy.asarray(years, dtype=numpy.int64)
+    rosh_hashanah_jd = rosh_hashanah_many(years)
+    next_rh_jd = rosh_hashanah_many(years + 1)
+    adar_i = length_adar_i * is_leap_many(years)
+    excess = (next_rh_jd - rosh_hashanah_jd) - (354 + adar_i)
+    return (rosh_hashanah_jd + length_4 + excess + length_shevat + adar_i +
+            length_adar + 14)
+
+def months_before_year_many(years):
+    return ((years - 1) / 19) * 235 + metonic_months_array[(years - 1) % 19]
+
+def is_leap_many(years):
+    return leap_years_array[years % 19]
+
+if numpy is not None:
+    metonic_months_array = numpy.array(metonic_months, dtype=numpy.int64)
+    leap_years_array = numpy.array([ is_leap(r) for r in range(19) ])
+
+
+###########################
+# From JD to a Hebrew date.
+
+# Months are numbered from Tishrei, counting Adar I as month 6 whether or not
+# the year has one, so that Adar is always month 7.
+
+month_names = [ None,
+        'Tishrei', 'Cheshvan', 'Kislev', 'Tevet', 'Shevat', 'Adar I', 'Adar',
+        'Nisan', 'Iyar', 'Sivan', 'Tamuz', 'Av', 'Elul' ]
+
+month_lengths = [ None,
+        length_tishrei, length_cheshvan, length_kislev, length_tevet,
+        length_shevat, length_adar_i, length_adar, length_nisan, length_iyar,
+        length_sivan, length_tamuz, length_av, length_elul ]
+
+# To find the year, we keep a sorted list of the Rosh Hashanah of every year
+# in some range (plus the one after it, so we know where the last year ends)
+# and bisect it.
+
+class RoshHashanahIndex(object):
+
+    def __init__(self, first_year, last_year):
+        self.first_year = first_year
+        self.last_year = last_year
+        self.jds = array.array('l', [ wd_to_jd(rosh_hashanah(year))
+                for year in range(first_year, last_year + 2) ])
+        self.jd_array = None
+
+    def year_of(self, jd):
+        i = bisect.bisect_right(self.jds, jd) - 1
+        if i < 0 or i >= len(self.jds) - 1:
+            raise ValueError('JD %d is outside AM %d-%d' %
+                    (jd, self.first_year, self.last_year))
+        return self.first_year + i
+
+    def as_array(self):
+        if self.jd_array is None:
+            self.jd_array = numpy.array(self.jds, dtype=numpy.int64)
+        return self.jd_array
+
+default_index_years = (1, 9999)
+default_index = None
+
+def rosh_hashanah_index():
+    global default_index
+    if default_index is None:
+        default_index = RoshHashanahIndex(*default_index_years)
+    return default_index
+
+def jd_to_hebrew(jd, index=None):
+    if index is None: index = rosh_hashanah_index()
+    year = index.year_of(jd)
+    starts = hebrew_year(year).month_starts()
+    month = bisect.bisect_right(starts, jd)
+    return (year, month, jd - starts[month - 1] + 1)
+
+# The same for a NumPy array of JDs, returning arrays of years, months and
+# days.  Here we lay out every year's months side by side, rather than asking
+# HebrewYear, and count how many of them have begun by each JD.
+
+def jd_to_hebrew_many(jds, index=None):
+    if index is None: index = rosh_hashanah_index()
+    jds = numpy.asarray(jds, dtype=numpy.int64)
+    rosh_hashanah_jds = index.as_array()
+
+    i = numpy.searchsorted(rosh_hashanah_jds, jds, side='right') - 1
+    if numpy.any((i < 0) | (i >= len(rosh_hashanah_jds) - 1)):
+        raise ValueError('JDs outside AM %d-%d' %
+                (index.first_year, index.last_year))
+    years = index.first_year + i
+    leap = is_leap_many(years)
+    excess = (rosh_hashanah_jds[i + 1] - rosh_hashanah_jds[i] -
+            (354 + length_adar_i * leap))
+
+    lengths = numpy.tile(month_lengths_array, (len(jds), 1))
+    lengths[:, 1] += excess > 0
+    lengths[:, 2] -= excess < 0
+    lengths[:, 5] *= leap
+    starts = numpy.cumsum(lengths, axis=1) - lengths
+    starts += rosh_hashanah_jds[i][:, numpy.newaxis]
+
+    months = (starts <= jds[:, numpy.newaxis]).sum(axis=1)
+    days = jds - starts[numpy.arange(len(jds)), months - 1] + 1
+    return (years, months, days)
+
+if numpy is not None:
+    month_lengths_array = numpy.array(month_lengths[1:], dtype=numpy.int64)
+
 
 # Cheesy Anno Domini to Anno Mundi conversion which punts the issue of the
 # different New Years' Days by being pegged to Passover.
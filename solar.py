@@ -1,10 +1,23 @@
 #!/usr/bin/env python3
 # coding=utf-8
 
-from math import sin, cos, asin, acos, radians, pi, degrees
+from math import pi
 from PIL import Image, ImageDraw
+import sun
+from sun import (AXIAL_TILT, solar_zenith_angle, fast_approx_solar_declination,
+                 solar_declination, solar_zenith_angle_many)
+import argparse
+import hashlib
+import mmap
+import multiprocessing
+import multiprocessing.shared_memory
+import numpy
+import os
+import struct
+import sys
+import tempfile
+import zlib
 
-AXIAL_TILT = radians(23.44)
 CHUNK_FACTOR = 16
 SCALE_FACTOR = 5
 VECTOR_FILES = [
@@ -18,55 +31,353 @@ VECTOR_FILES = [
         'vectors/wasia.bdy',
 ]
 
-# https://en.wikipedia.org/wiki/Solar_zenith_angle
-def solar_zenith_angle(day, lat):
-    decl = solar_declination(day)
-    cos_theta = sin(lat) * sin(decl) + cos(lat) * cos(decl)
-    return acos(cos_theta)
-
-# https://en.wikipedia.org/wiki/Position_of_the_Sun#Declination_of_the_Sun_as_seen_from_Earth
-# Circular approximation of Earth's orbit introduces ~1º error.
-# "day" is ordinal starting at Jan 1 (10 days after solstice).
-def fast_approx_solar_declination(day):
-    return -1 * AXIAL_TILT * cos(2 * pi * (day + 10) / 365)
-
-def solar_declination(day):
-    return -1 * asin(0.39779 * cos(0.01720283777228211 * (day + 10)
-                                   + 0.03340560188317147 * sin(0.01720283777228211 * (day - 2))))
-
-im = Image.new('L', (365 * SCALE_FACTOR, 180 * SCALE_FACTOR))
-for day in range(365 * SCALE_FACTOR):
-    for lat in range(180 * SCALE_FACTOR):
-        angle = 2 * pi - solar_zenith_angle(day / SCALE_FACTOR,
-                                            radians(90 - lat / SCALE_FACTOR))
-        byte_angle = 256 * angle / (2 * pi)
-        scaled_angle = max(0, 256 - 3 * (256 - byte_angle))
-        chunked_angle = int((scaled_angle - CHUNK_FACTOR / 2)
-                            / CHUNK_FACTOR) * CHUNK_FACTOR
-        im.putpixel((day, lat), chunked_angle)
-
-draw = ImageDraw.Draw(im)
-
-for month in range(1,12):
-    x = month * 365 * SCALE_FACTOR / 12
-    draw.line([(x,0), (x,180 * SCALE_FACTOR)], fill=256)
-for filename in VECTOR_FILES:
-    f = open(filename, 'r')
-    prev = None
-    for line in f:
-        if line.startswith('{'): continue
-        for coord in line.split(' '):
-            coord = coord.strip()
-            if len(coord) < 1: continue
-
-            if coord == '-1':
-                prev = None
-            else:
-                (lat, lng) = coord.split('+')
-                pt = ((float(lng) + 180) * SCALE_FACTOR,
-                      (90 - float(lat)) * SCALE_FACTOR)
-                if prev:
-                    draw.line([prev, pt], fill=0)
-                prev = pt
-
-im.save('solar.png', 'PNG')
+# A window onto the chart is (first day, last day, northern latitude,
+# southern latitude); the last day and the southern edge are exclusive.  At a
+# given scale factor, a window covers the same pixels it would in the whole
+# chart at that scale.
+FULL_CHART = (0, 365, 90, -90)
+
+# Parsed coastlines are cached next to each .bdy file, in a binary file that
+# we memory-map rather than parse: a header recording the size and mtime of
+# the source it came from, then the offset of each polyline's first point (and
+# one past its last), then every point's latitude, then every longitude.
+VECTOR_CACHE_SUFFIX = '.cache'
+VECTOR_CACHE_MAGIC = b'BDYCACHE'
+VECTOR_CACHE_VERSION = 1
+VECTOR_CACHE_HEADER = '<8sIqqII4x'
+
+# The pixel bounds of a window in the whole chart: (left, right, top, bottom).
+def window_pixels(window, scale_factor):
+    (first_day, last_day, north, south) = window
+    return (round(first_day * scale_factor), round(last_day * scale_factor),
+            round((90 - north) * scale_factor),
+            round((90 - south) * scale_factor))
+
+def render_raster(scale_factor=SCALE_FACTOR, chunk_factor=CHUNK_FACTOR,
+                  window=FULL_CHART):
+    pixels = window_pixels(window, scale_factor)
+    return Image.fromarray(raster_pixels(scale_factor, chunk_factor, pixels))
+
+# The raster for a block of pixels, as a uint8 array, all at once: the
+# zenith angle over a row of days by a column of latitudes (so that the
+# declination is worked out once per day, and the sine and cosine of the
+# latitude once per row), then the scaling and the chunking over every pixel
+# together.  Each step is the same arithmetic as the scalar version, and
+# astype truncates toward zero just as int() does.
+def raster_pixels(scale_factor, chunk_factor, pixels):
+    (left, right, top, bottom) = pixels
+    days = numpy.arange(left, right) / scale_factor
+    lats = numpy.radians(90 - numpy.arange(top, bottom) / scale_factor)
+    angle = 2 * pi - solar_zenith_angle_many(days[None, :], lats[:, None])
+    byte_angle = 256 * angle / (2 * pi)
+    scaled_angle = numpy.maximum(0, 256 - 3 * (256 - byte_angle))
+    chunked_angle = ((scaled_angle - chunk_factor / 2)
+                     / chunk_factor).astype(int) * chunk_factor
+    return chunked_angle.astype(numpy.uint8)
+
+# The same, on every core: the raster is cut into bands of rows, and a pool
+# of worker processes renders each band straight into its place in one
+# shared-memory buffer, so nothing is pickled back or stitched together.
+# PIL keeps its own copy of the finished raster, so the buffer is copied
+# into an image once, at the end.
+def render_raster_parallel(scale_factor=SCALE_FACTOR,
+                           chunk_factor=CHUNK_FACTOR, window=FULL_CHART,
+                           jobs=None, band_rows=None):
+    (left, right, top, bottom) = window_pixels(window, scale_factor)
+    (width, height) = (right - left, bottom - top)
+    jobs = jobs or os.cpu_count() or 1
+    band_rows = band_rows or max(1, -(-height // (4 * jobs)))
+    shm = multiprocessing.shared_memory.SharedMemory(
+            create=True, size=max(1, width * height))
+    try:
+        bands = [(shm.name, width, height, scale_factor, chunk_factor,
+                  (left, right, top, bottom), first_row,
+                  min(first_row + band_rows, height))
+                 for first_row in range(0, height, band_rows)]
+        with multiprocessing.Pool(jobs) as pool:
+            pool.map(render_band, bands)
+        view = shm.buf[:width * height]
+        try:
+            return Image.frombytes('L', (width, height), view)
+        finally:
+            view.release()
+    finally:
+        shm.close()
+        shm.unlink()
+
+def render_band(band):
+    (name, width, height, scale_factor, chunk_factor, pixels,
+     first_row, last_row) = band
+    (left, right, top, bottom) = pixels
+    shm = multiprocessing.shared_memory.SharedMemory(name=name)
+    try:
+        raster = numpy.ndarray((height, width), dtype=numpy.uint8,
+                               buffer=shm.buf)
+        raster[first_row:last_row] = raster_pixels(
+                scale_factor, chunk_factor,
+                (left, right, top + first_row, top + last_row))
+        del raster
+    finally:
+        shm.close()
+
+# Split a .bdy file into polylines.  Points are "lat+lng", and -1 ends a
+# polyline; a polyline of fewer than two points draws nothing, so we drop it.
+def parse_vectors(filename):
+    offsets = [0]
+    lats = []
+    lngs = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.startswith('{'): continue
+            for coord in line.split(' '):
+                coord = coord.strip()
+                if len(coord) < 1: continue
+
+                if coord == '-1':
+                    end_polyline(offsets, lats, lngs)
+                else:
+                    (lat, lng) = coord.split('+')
+                    lats.append(float(lat))
+                    lngs.append(float(lng))
+    end_polyline(offsets, lats, lngs)
+    return (offsets, lats, lngs)
+
+def end_polyline(offsets, lats, lngs):
+    if len(lats) - offsets[-1] < 2:
+        del lats[offsets[-1]:]
+        del lngs[offsets[-1]:]
+    else:
+        offsets.append(len(lats))
+
+def build_vector_cache(filename, cache_filename):
+    stat = os.stat(filename)
+    (offsets, lats, lngs) = parse_vectors(filename)
+    (fd, temp) = tempfile.mkstemp(dir=os.path.dirname(cache_filename) or '.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(struct.pack(VECTOR_CACHE_HEADER, VECTOR_CACHE_MAGIC,
+                            VECTOR_CACHE_VERSION, stat.st_mtime_ns,
+                            stat.st_size, len(offsets), len(lats)))
+        f.write(numpy.array(offsets, dtype='<i4').tobytes())
+        f.write(numpy.array(lats, dtype='<f4').tobytes())
+        f.write(numpy.array(lngs, dtype='<f4').tobytes())
+    os.replace(temp, cache_filename)
+
+# The polyline offsets, latitudes and longitudes of a .bdy file, as views onto
+# its memory-mapped cache, which is built first if it's missing or stale.
+def load_vectors(filename):
+    cache_filename = filename + VECTOR_CACHE_SUFFIX
+    stat = os.stat(filename)
+    for attempt in range(2):
+        vectors = map_vector_cache(cache_filename, stat)
+        if vectors is not None: return vectors
+        build_vector_cache(filename, cache_filename)
+    raise ValueError('cannot cache %s' % filename)
+
+# Map a cache file, or return None if it's stale: if it's missing, empty,
+# cut short, not one of ours, or made from a different version of the source.
+def map_vector_cache(cache_filename, stat):
+    header_size = struct.calcsize(VECTOR_CACHE_HEADER)
+    try:
+        with open(cache_filename, 'rb') as f:
+            cache = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(cache) >= header_size:
+        (magic, version, mtime_ns, size, count, points) = \
+                struct.unpack_from(VECTOR_CACHE_HEADER, cache)
+        if (magic == VECTOR_CACHE_MAGIC and
+                version == VECTOR_CACHE_VERSION and
+                mtime_ns == stat.st_mtime_ns and size == stat.st_size and
+                len(cache) == header_size + 4 * count + 8 * points):
+            offsets = numpy.frombuffer(cache, dtype='<i4', count=count,
+                                       offset=header_size)
+            offset = header_size + offsets.nbytes
+            lats = numpy.frombuffer(cache, dtype='<f4', count=points,
+                                    offset=offset)
+            offset += lats.nbytes
+            lngs = numpy.frombuffer(cache, dtype='<f4', count=points,
+                                    offset=offset)
+            return (offsets, lats, lngs)
+    cache.close()
+    return None
+
+# Every coastline polyline, in pixels of the whole chart at the given scale,
+# along with the bounding box of each: (polylines, lefts, rights, tops,
+# bottoms).  PIL truncates coordinates to pixels, which for the whole chart
+# (where none are negative) is flooring them; we floor them ourselves, so
+# that when they're moved to the origin of a window, lines running off its
+# top or left edge land on the same pixels as they would in the whole chart.
+def coastlines(scale_factor=SCALE_FACTOR):
+    polylines = []
+    for filename in VECTOR_FILES:
+        (offsets, lats, lngs) = load_vectors(filename)
+        points = numpy.empty((len(lats), 2))
+        points[:, 0] = (lngs.astype(float) + 180) * scale_factor
+        points[:, 1] = (90 - lats.astype(float)) * scale_factor
+        points = numpy.floor(points)
+        for (start, end) in zip(offsets[:-1], offsets[1:]):
+            polylines.append(points[start:end])
+    if not polylines:
+        return (polylines,) + (numpy.empty(0),) * 4
+    (lefts, tops) = numpy.array([line.min(axis=0) for line in polylines]).T
+    (rights, bottoms) = numpy.array([line.max(axis=0) for line in polylines]).T
+    return (polylines, lefts, rights, tops, bottoms)
+
+# Draw the month lines and coastlines over a raster of the given window.
+def draw_overlay(im, scale_factor=SCALE_FACTOR, window=FULL_CHART,
+                 lines=None):
+    (left, right, top, bottom) = window_pixels(window, scale_factor)
+    if lines is None: lines = coastlines(scale_factor)
+    draw_overlay_pixels(im, scale_factor, left, top, lines)
+
+# The same, given the pixel at the raster's top left corner.  Only the
+# polylines whose bounding boxes reach into the raster are drawn.
+def draw_overlay_pixels(im, scale_factor, left, top, lines):
+    (width, height) = im.size
+    draw = ImageDraw.Draw(im)
+
+    for month in range(1,12):
+        x = (month * 365 * scale_factor) // 12 - left
+        draw.line([(x,-top), (x,180 * scale_factor - top)], fill=256)
+    (polylines, lefts, rights, tops, bottoms) = lines
+    visible = ((rights >= left) & (lefts < left + width) &
+               (bottoms >= top) & (tops < top + height))
+    for i in numpy.flatnonzero(visible):
+        draw.line((polylines[i] - (left, top)).ravel().tolist(), fill=0)
+
+# jobs is how many processes to render the raster in; None means one per
+# core.
+def render_chart(scale_factor=SCALE_FACTOR, chunk_factor=CHUNK_FACTOR,
+                 window=FULL_CHART, overlay=True, jobs=1):
+    if jobs == 1:
+        im = render_raster(scale_factor, chunk_factor, window)
+    else:
+        im = render_raster_parallel(scale_factor, chunk_factor, window, jobs)
+    if overlay: draw_overlay(im, scale_factor, window)
+    return im
+
+# Rendered tiles are kept in a directory as PNGs, named for everything that
+# went into them: their pixels, the scale and chunk factors, and a hash of
+# the code (this file and sun.py) and the coastlines it drew, so that they go
+# stale by themselves when either changes.
+def tile_version(overlay):
+    digest = hashlib.sha1()
+    for module in [sys.modules[__name__], sun]:
+        with open(os.path.abspath(module.__file__), 'rb') as f:
+            digest.update(f.read())
+    if overlay:
+        for filename in VECTOR_FILES:
+            stat = os.stat(filename)
+            digest.update(('%s %d %d' % (filename, stat.st_size,
+                                         stat.st_mtime_ns)).encode())
+    return digest.hexdigest()[:16]
+
+def tile_path(cache_dir, scale_factor, chunk_factor, window, overlay):
+    (left, right, top, bottom) = window_pixels(window, scale_factor)
+    return os.path.join(cache_dir, '%s-%s-%d-%d-%d-%d-%d%s.png' % (
+            tile_version(overlay), scale_factor, chunk_factor,
+            left, right, top, bottom, '' if overlay else '-bare'))
+
+def render_tile(cache_dir, scale_factor=SCALE_FACTOR,
+                chunk_factor=CHUNK_FACTOR, window=FULL_CHART, overlay=True,
+                jobs=1):
+    path = tile_path(cache_dir, scale_factor, chunk_factor, window, overlay)
+    if os.path.exists(path):
+        with Image.open(path) as im:
+            im.load()
+            return im
+    im = render_chart(scale_factor, chunk_factor, window, overlay, jobs)
+    os.makedirs(cache_dir, exist_ok=True)
+    (fd, temp) = tempfile.mkstemp(dir=cache_dir, suffix='.png')
+    with os.fdopen(fd, 'wb') as f:
+        im.save(f, 'PNG')
+    os.replace(temp, path)
+    return im
+
+# The window for the tile in the given column and row of a grid of tiles
+# tile_size pixels square, at the given scale.  Tiles at the right and bottom
+# edges are cut short.
+def tile_window(column, row, scale_factor=SCALE_FACTOR, tile_size=256):
+    left = column * tile_size
+    top = row * tile_size
+    if left >= 365 * scale_factor or top >= 180 * scale_factor:
+        raise ValueError('no tile at column %d, row %d' % (column, row))
+    right = min(left + tile_size, 365 * scale_factor)
+    bottom = min(top + tile_size, 180 * scale_factor)
+    return (left / scale_factor, right / scale_factor,
+            90 - top / scale_factor, 90 - bottom / scale_factor)
+
+# Write the chart as a PNG to a file, one band of rows at a time: render the
+# band, draw its part of the overlay, filter and compress it, and write it
+# out, so that memory use depends on the band's size, not the chart's.  PIL
+# can't write a PNG a piece at a time, so we write one ourselves: 8-bit
+# greyscale, every row unfiltered.
+def write_png_streaming(f, scale_factor=SCALE_FACTOR,
+                        chunk_factor=CHUNK_FACTOR, window=FULL_CHART,
+                        overlay=True, band_rows=256):
+    (left, right, top, bottom) = window_pixels(window, scale_factor)
+    width = right - left
+    lines = coastlines(scale_factor) if overlay else None
+
+    f.write(b'\x89PNG\r\n\x1a\n')
+    write_png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', width, bottom - top,
+                                            8, 0, 0, 0, 0))
+    compressor = zlib.compressobj()
+    for first_row in range(top, bottom, band_rows):
+        last_row = min(first_row + band_rows, bottom)
+        raster = raster_pixels(scale_factor, chunk_factor,
+                               (left, right, first_row, last_row))
+        if overlay:
+            im = Image.fromarray(raster)
+            draw_overlay_pixels(im, scale_factor, left, first_row, lines)
+            raster = numpy.asarray(im)
+        rows = numpy.zeros((last_row - first_row, width + 1),
+                           dtype=numpy.uint8)
+        rows[:, 1:] = raster
+        data = compressor.compress(rows.tobytes())
+        if data: write_png_chunk(f, b'IDAT', data)
+    write_png_chunk(f, b'IDAT', compressor.flush())
+    write_png_chunk(f, b'IEND', b'')
+
+def write_png_chunk(f, kind, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind))))
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+            description="Chart the sun's zenith angle by day and latitude.")
+    parser.add_argument('--scale', type=int, default=SCALE_FACTOR)
+    parser.add_argument('--chunk', type=int, default=CHUNK_FACTOR)
+    parser.add_argument('--days', type=float, nargs=2, default=FULL_CHART[:2],
+                        metavar=('FIRST', 'LAST'))
+    parser.add_argument('--lats', type=float, nargs=2, default=FULL_CHART[2:],
+                        metavar=('NORTH', 'SOUTH'))
+    parser.add_argument('--no-overlay', action='store_true')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='processes to render in (default: one per core)')
+    parser.add_argument('--tile-cache', metavar='DIR',
+                        help='keep rendered windows in DIR and reuse them')
+    parser.add_argument('--stream', action='store_true',
+                        help='write the PNG a band of rows at a time')
+    parser.add_argument('--band-rows', type=int, default=256)
+    parser.add_argument('--output', '-o', default='solar.png')
+    args = parser.parse_args(argv)
+
+    window = tuple(args.days) + tuple(args.lats)
+    overlay = not args.no_overlay
+    if args.stream:
+        with open(args.output, 'wb') as f:
+            write_png_streaming(f, args.scale, args.chunk, window, overlay,
+                                args.band_rows)
+        return
+    if args.tile_cache:
+        im = render_tile(args.tile_cache, args.scale, args.chunk, window,
+                         overlay, args.jobs)
+    else:
+        im = render_chart(args.scale, args.chunk, window, overlay, args.jobs)
+    im.save(args.output, 'PNG')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,67 @@
+# coding=utf-8
+# Where the sun is: its declination on a given day, and its zenith angle at a
+# given latitude on that day.  Nothing here draws anything, so it's safe to
+# import from anywhere; solar.py uses it for its chart.
+#
+# Days are ordinal, starting at Jan 1 (10 days after the solstice), and may
+# be fractional.  Latitudes and all the angles returned are in radians.
+#
+# The _many versions take arrays of days and latitudes (or anything NumPy can
+# turn into one) and return arrays, broadcasting them against each other in
+# the usual way: pass days of shape (1, D) and latitudes of shape (S, 1) to
+# get the angle at each of S sites on each of D days.  They need NumPy; the
+# scalar versions don't.
+
+from math import sin, cos, asin, acos, radians, pi
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+AXIAL_TILT = radians(23.44)
+
+# https://en.wikipedia.org/wiki/Solar_zenith_angle
+def solar_zenith_angle(day, lat, accuracy='exact'):
+    decl = declination_formulas[accuracy][0](day)
+    cos_theta = sin(lat) * sin(decl) + cos(lat) * cos(decl)
+    return acos(cos_theta)
+
+# https://en.wikipedia.org/wiki/Position_of_the_Sun#Declination_of_the_Sun_as_seen_from_Earth
+# Circular approximation of Earth's orbit introduces ~1º error.
+def fast_approx_solar_declination(day):
+    return -1 * AXIAL_TILT * cos(2 * pi * (day + 10) / 365)
+
+def solar_declination(day):
+    return -1 * asin(0.39779 * cos(0.01720283777228211 * (day + 10)
+                                   + 0.03340560188317147 * sin(0.01720283777228211 * (day - 2))))
+
+
+##########################################
+# The same over whole arrays, all at once.
+
+# The declination is worked out once per day and the sine and cosine of the
+# latitude once per latitude, however many of the other there are.
+def solar_zenith_angle_many(days, lats, accuracy='exact'):
+    decl = declination_formulas[accuracy][1](days)
+    lats = numpy.asarray(lats)
+    cos_theta = (numpy.sin(lats) * numpy.sin(decl)
+                 + numpy.cos(lats) * numpy.cos(decl))
+    return numpy.arccos(cos_theta)
+
+def fast_approx_solar_declination_many(days):
+    days = numpy.asarray(days)
+    return -1 * AXIAL_TILT * numpy.cos(2 * pi * (days + 10) / 365)
+
+def solar_declination_many(days):
+    days = numpy.asarray(days)
+    return -1 * numpy.arcsin(0.39779 * numpy.cos(0.01720283777228211 * (days + 10)
+                                               + 0.03340560188317147 * numpy.sin(0.01720283777228211 * (days - 2))))
+
+# The declination formulas, scalar and batch, for each accuracy: 'exact' is
+# the asin formula, and 'fast' the cosine approximation.
+declination_formulas = {
+        'exact' : (solar_declination, solar_declination_many),
+        'fast' : (fast_approx_solar_declination,
+                  fast_approx_solar_declination_many)
+        }
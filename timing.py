@@ -0,0 +1,112 @@
+# Lightweight timing of the stages of a request.
+#
+# Wrap a stage in "with timing.stage('name'):".  While timing is switched off
+# (the default, unless ANTIKYTHERA_TIMING is set in the environment), that
+# costs one function call and one attribute lookup, and records nothing.
+# While it's on, each stage's duration is added to the current request's
+# list, if there is one, for a Server-Timing header, and to running totals
+# and a histogram of durations per stage, for the metrics endpoint.
+
+import os
+import threading
+import time
+
+enabled = bool(os.environ.get('ANTIKYTHERA_TIMING'))
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+# Histogram bucket upper bounds, in milliseconds.  The last bucket, reported
+# with a bound of None, catches everything slower.
+
+buckets = [ 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000 ]
+
+class StageMetrics(object):
+    __slots__ = ('count', 'total', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.histogram = [ 0 ] * (len(buckets) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        ms = seconds * 1000
+        i = 0
+        while i < len(buckets) and ms > buckets[i]: i += 1
+        self.histogram[i] += 1
+
+    def info(self):
+        return {
+                'count' : self.count,
+                'total_ms' : self.total * 1000,
+                'mean_ms' : self.total * 1000 / self.count if self.count else 0,
+                'histogram' : zip(buckets + [ None ], self.histogram)
+                }
+
+metrics = {}
+metrics_lock = threading.Lock()
+requests = threading.local()
+
+class Stage(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *exc_info):
+        seconds = time.time() - self.start
+        record = getattr(requests, 'stages', None)
+        if record is not None: record.append((self.name, seconds))
+        with metrics_lock:
+            if self.name not in metrics: metrics[self.name] = StageMetrics()
+            metrics[self.name].add(seconds)
+
+class NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self): pass
+
+    def __exit__(self, *exc_info): pass
+
+null_stage = NullStage()
+
+def stage(name):
+    if not enabled: return null_stage
+    return Stage(name)
+
+# Collect the stages of one request, on this thread.
+
+def begin_request():
+    requests.stages = [] if enabled else None
+
+def end_request():
+    stages = getattr(requests, 'stages', None)
+    requests.stages = None
+    return stages or []
+
+# Stages with the same name are added together.
+
+def server_timing(stages):
+    totals = {}
+    order = []
+    for (name, seconds) in stages:
+        if name not in totals:
+            totals[name] = 0.0
+            order += [ name ]
+        totals[name] += seconds
+    return ', '.join('%s;dur=%.3f' % (name, totals[name] * 1000)
+            for name in order)
+
+def info():
+    with metrics_lock:
+        return dict((name, metrics[name].info()) for name in metrics)
+
+def reset():
+    with metrics_lock:
+        metrics.clear()